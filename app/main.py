@@ -1,42 +1,130 @@
-from fastapi import FastAPI, HTTPException, Request
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pathlib import Path
-from typing import Any, Dict, Optional
-from pydantic import BaseModel, Field
-from pprint import pformat
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+import asyncio
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import stat
+import tempfile
+import aiofiles
 import httpx
-
-app = FastAPI()
+import msgspec
+
+
+def _new_pool() -> ProcessPoolExecutor:
+    # pypdf / python-docx extraction is CPU-bound and holds the GIL, so it
+    # runs in worker processes rather than threads. Workers start lazily from
+    # inside the running loop, with to_thread/aiofiles threads alive, so they
+    # must not be forked from this process.
+    return ProcessPoolExecutor(
+        max_workers=min(4, os.cpu_count() or 2),
+        mp_context=multiprocessing.get_context("forkserver"),
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled client for all attachment downloads, so connections and TLS
+    # sessions are reused across requests.
+    app.state.http = httpx.AsyncClient(
+        timeout=60,
+        follow_redirects=True,
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+    )
+    app.state.pool = _new_pool()
+    yield
+    await app.state.http.aclose()
+    app.state.pool.shutdown(cancel_futures=True)
+
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+# Compress larger bodies (mainly /latest-context) for clients that send
+# Accept-Encoding: gzip; small responses go out as is.
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+logger = logging.getLogger(__name__)
 
 # Base directory where text files live. This keeps file reads constrained to this folder.
 BASE_DIR = Path("/tmp") / "files"
 ATTACH_DIR = BASE_DIR / "attachments"
 
-def extract_text_from_file(path: Path) -> str:
-    """
-    Best-effort text extraction for common types.
-    - .docx uses python-docx (you have it)
-    - .pdf uses pypdf (install if you want PDF text)
-    """
-    suffix = path.suffix.lower()
+# Attachments larger than this are skipped instead of downloaded.
+MAX_ATTACH = 25 * 1024 * 1024
+
+# The context filename is fixed, so resolve it once instead of per request.
+BASE_DIR.mkdir(parents=True, exist_ok=True)
+CONTEXT_PATH = (BASE_DIR / "context.txt").resolve()
+
+# Identity of one version of a file: (st_ino, st_mtime_ns, st_size). Every
+# write goes through os.replace and gets a new inode, so this tells versions
+# apart even when two writes land in the same mtime tick.
+FileKey = Tuple[int, int, int]
+
+# Last known contents of CONTEXT_PATH as (file key, text). Updated by
+# /webhook on write (with the raw bytes, decoded on first read) and by
+# /latest-context on a miss.
+_CTX_CACHE: Optional[Tuple[FileKey, Union[str, bytes]]] = None
+
+try:
+    from docx import Document as _docx_Document
+except ImportError:  # python-docx not installed
+    _docx_Document = None
+
+try:
+    from pypdf import PdfReader as _PdfReader
+except ImportError:  # pip install pypdf (only if you want PDF extraction)
+    _PdfReader = None
+
 
-    if suffix in {".txt", ".csv", ".log"}:
-        return path.read_text(encoding="utf-8", errors="replace")
+def _read_text(path: Path) -> str:
+    return path.read_text(encoding="utf-8", errors="replace")
 
-    if suffix == ".docx":
-        import docx
-        d = docx.Document(str(path))
-        return "\n".join(p.text for p in d.paragraphs).strip()
 
-    if suffix == ".pdf":
-        # pip install pypdf   (only if you want PDF extraction)
-        from pypdf import PdfReader
-        reader = PdfReader(str(path))
-        return "\n".join((page.extract_text() or "") for page in reader.pages).strip()
+def _read_docx(path: Path) -> str:
+    if _docx_Document is None:
+        raise RuntimeError("python-docx is not installed")
+    d = _docx_Document(str(path))
+    return "\n".join(p.text for p in d.paragraphs).strip()
 
+
+def _read_pdf(path: Path) -> str:
+    if _PdfReader is None:
+        raise RuntimeError("pypdf is not installed")
+    reader = _PdfReader(str(path))
+    return "\n".join((page.extract_text() or "") for page in reader.pages).strip()
+
+
+def _noop(path: Path) -> str:
     # images/other binaries: skip
     return ""
 
 
+_EXTRACTORS = {
+    ".txt": _read_text,
+    ".csv": _read_text,
+    ".log": _read_text,
+    ".docx": _read_docx,
+    ".pdf": _read_pdf,
+}
+
+
+def extract_text_from_file(path: Path) -> str:
+    """
+    Best-effort text extraction for common types.
+    - .docx uses python-docx (you have it)
+    - .pdf uses pypdf (install if you want PDF text)
+    """
+    return _EXTRACTORS.get(path.suffix.lower(), _noop)(path)
+
+
 def _safe_resolve(base: Path, filename: str) -> Path:
     """Resolve filename against base and prevent path traversal.
 
@@ -52,56 +140,136 @@ def _safe_resolve(base: Path, filename: str) -> Path:
     raise ValueError("invalid filename")
 
 
-def clean_text(text: str) -> str:
-    """Clean input text before persisting.
+# C0 control characters (except tab and newline) plus DEL. All of them are
+# single bytes in UTF-8 and never occur inside a multi-byte sequence, so they
+# can be deleted from the encoded text directly.
+_CTRL_BYTES = bytes(c for c in range(0x20) if c not in (0x09, 0x0A)) + b"\x7f"
+
+def _ws_pattern(reverse: bool = False) -> bytes:
+    """Regex for one whitespace character other than newline, as str.strip()
+    understands it: space/tab plus the UTF-8 encodings of Unicode whitespace
+    (NBSP, NEL, U+2028, ...). The remaining ASCII whitespace is control
+    characters, removed before this is used.
+
+    With reverse=True the pattern matches the byte-reversed encodings.
+    """
+    by_prefix: Dict[bytes, List[bytes]] = {}
+    for c in range(0x80, 0x3001):
+        if chr(c).isspace():
+            e = chr(c).encode("utf-8")
+            by_prefix.setdefault(e[:-1], []).append(e[-1:])
+    alts = [rb"[ \t]"]
+    for prefix, lasts in by_prefix.items():
+        last = b"[" + b"".join(re.escape(x) for x in lasts) + b"]"
+        alts.append(last + re.escape(prefix[::-1]) if reverse else re.escape(prefix) + last)
+    return b"(?:" + b"|".join(alts) + b")"
+
+
+_WS = _ws_pattern()
+_WS_REV = _ws_pattern(reverse=True)
+
+# These run on the byte-reversed text, so every match starts at a newline and
+# consumes the whitespace run in one go. (A forward r"\s+(?=\n)" restarts at
+# each character of a long run and goes quadratic.)
+# Newline plus the trailing whitespace of the line before it
+_TRAIL_WS_REV = re.compile(rb"\n" + _WS_REV + rb"++")
+# The last line is blank
+_BLANK_LAST_REV = re.compile(_WS_REV + rb"*+(?:\n|\Z)")
+# Whitespace at one end of the text
+_EDGE_WS = re.compile(rb"(?:" + _WS + rb"|\n)*+")
+_EDGE_WS_REV = re.compile(rb"(?:" + _WS_REV + rb"|\n)*+")
+# Three or more newlines, i.e. more than one consecutive blank line
+_MULTI_BLANK = re.compile(rb"\n{3,}")
+
+
+def clean_text_bytes(b: bytes) -> bytes:
+    """Clean UTF-8 encoded text before persisting.
 
     - Normalize CRLF to LF
     - Strip leading/trailing whitespace
     - Collapse multiple consecutive blank lines to a single blank line
     - Remove C0 control characters except for tab and newline
     """
+    # Normalize line endings
+    b = b.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+
+    # Remove undesired control characters (keep tab and newline)
+    b = b.translate(None, _CTRL_BYTES)
+
+    # Strip trailing whitespace on each line, then collapse multiple blank lines
+    r = _TRAIL_WS_REV.sub(b"\n", b[::-1])
+    r = _MULTI_BLANK.sub(b"\n\n", r)
+
+    # Keep a single trailing newline if the input ended on a blank line
+    ends_blank = _BLANK_LAST_REV.match(r) is not None
+
+    # Strip both ends
+    b = r[_EDGE_WS_REV.match(r).end():][::-1]
+    b = b[_EDGE_WS.match(b).end():]
+    return b + (b"\n" if ends_blank else b"")
+
+
+def clean_text(text: str) -> str:
+    """str wrapper around clean_text_bytes."""
     if text is None:
         return ""
+    return clean_text_bytes(text.encode("utf-8")).decode("utf-8")
 
-    # Normalize line endings
-    s = text.replace("\r\n", "\n").replace("\r", "\n")
 
-    # Remove undesired control characters (keep tab and newline)
-    cleaned_chars = []
-    for ch in s:
-        # allow printable characters, newline and tab
-        if ch == "\n" or ch == "\t" or (" " <= ch <= "~") or (ord(ch) > 0x7f):
-            cleaned_chars.append(ch)
-        # else drop the character
-    s = "".join(cleaned_chars)
-
-    # Strip leading/trailing whitespace on each line, then collapse multiple blank lines
-    lines = [ln.rstrip() for ln in s.split("\n")]  # remove trailing spaces
-
-    out_lines = []
-    blank_seq = 0
-    for ln in lines:
-        if ln.strip() == "":
-            blank_seq += 1
-        else:
-            blank_seq = 0
+class ProxiedMailPayload(msgspec.Struct):
+    # ProxiedMail's key spelling varies, so both variants are decoded. Values
+    # are typed Any so an odd sender can't get the whole email rejected; see
+    # _as_text for how they are rendered.
+    body_plain: Any = msgspec.field(name="body-plain", default=None)
+    body_plain_alt: Any = msgspec.field(name="body_plain", default=None)
+    body_html: Any = msgspec.field(name="body-html", default=None)
+    body_html_alt: Any = msgspec.field(name="body_html", default=None)
+    Subject: Any = None
+    subject: Any = None
+    from_: Any = msgspec.field(name="from", default=None)
+    From: Any = None
+    to: Any = None
+    To: Any = None
 
-        if blank_seq > 1:
-            # skip extra blank lines
-            continue
-        out_lines.append(ln)
 
-    result = "\n".join(out_lines).strip() + ("\n" if out_lines and out_lines[-1] == "" else "")
-    return result
+class Webhook(msgspec.Struct):
+    # legacy shape
+    context: Optional[str] = None
+    # ProxiedMail shape
+    id: Any = None
+    payload: Optional[ProxiedMailPayload] = None
+    # decoded as-is and filtered in the handler: anything that isn't a list
+    # of {"filename": ..., "url": ...} objects is ignored, not rejected
+    attachments: Any = None
 
 
-class ProxiedMailWebhook(BaseModel):
-    id: Optional[str] = None
-    payload: Dict[str, Any] = Field(default_factory=dict)
+def _file_key(st: os.stat_result) -> FileKey:
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
 
 
-class LegacyWebhook(BaseModel):
-    context: str
+def _atomic_write_bytes(path: Path, data: bytes) -> FileKey:
+    """Write data to a temp file next to path, then rename it over path.
+
+    Readers see either the old or the new contents, never a partial file.
+    Returns the file key of the written file (the rename keeps it).
+    """
+    try:
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name + ".", suffix=".tmp")
+    except FileNotFoundError:
+        # the directory was removed while running (tmp cleaner, /tmp reset)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            key = _file_key(os.fstat(f.fileno()))
+        os.replace(tmp, path)
+        return key
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
 
 def sanitize_filename(name: str) -> str:
     # minimal sanitize for Vercel/tmp
@@ -109,39 +277,140 @@ def sanitize_filename(name: str) -> str:
     return name[:200] if name else "file.bin"
 
 
-async def download_attachment(url: str) -> bytes:
-    async with httpx.AsyncClient(timeout=60, follow_redirects=True) as client:
-        r = await client.get(url)
-        r.raise_for_status()
-        return r.content
+async def download_attachment(url: str, client: httpx.AsyncClient, file_path: Path) -> bool:
+    """Stream url into file_path. Returns False if it exceeds MAX_ATTACH.
+
+    Unless the download completes, file_path is removed again, so no partial
+    or empty files are left behind in ATTACH_DIR.
+    """
+    done = False
+    try:
+        # stream chunks straight to disk instead of buffering the whole body
+        async with client.stream("GET", url) as r:
+            r.raise_for_status()
+            if int(r.headers.get("content-length", "0")) > MAX_ATTACH:
+                return False
+            size = 0
+            async with aiofiles.open(file_path, "wb") as f:
+                async for chunk in r.aiter_bytes(chunk_size=65536):
+                    size += len(chunk)
+                    if size > MAX_ATTACH:
+                        # the server sent no (or a wrong) content-length
+                        return False
+                    await f.write(chunk)
+        done = True
+        return True
+    finally:
+        if not done:
+            await asyncio.to_thread(file_path.unlink, missing_ok=True)
+
+
+def _as_text(value: Any) -> str:
+    """Render a loosely typed payload value: strings as-is, lists of strings
+    joined with ", ", and anything else dropped."""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list) and all(isinstance(v, str) for v in value):
+        return ", ".join(value)
+    return ""
 
 
-def extract_context_from_proxiedmail(pm: ProxiedMailWebhook) -> str:
+def extract_context_from_payload(p: ProxiedMailPayload) -> str:
     """
-    ProxiedMail puts message content in pm.payload["body-plain"] (preferred) and/or pm.payload["body-html"].
+    ProxiedMail puts message content in payload["body-plain"] (preferred) and/or payload["body-html"].
     It also includes fields like "from", "to", "subject" in the same payload object. :contentReference[oaicite:1]{index=1}
     """
-    p = pm.payload or {}
+    subject = _as_text(p.Subject) or _as_text(p.subject)
+    from_ = _as_text(p.from_) or _as_text(p.From)
+    to_ = _as_text(p.to) or _as_text(p.To)
 
-    body_plain = p.get("body-plain") or p.get("body_plain") or ""
-    body_html = p.get("body-html") or p.get("body_html") or ""
+    # Prefer plain text; only look at HTML if the plain body is blank
+    body = _as_text(p.body_plain) or _as_text(p.body_plain_alt)
+    if not body.strip():
+        body = _as_text(p.body_html) or _as_text(p.body_html_alt)
 
-    # Optional: prepend a tiny header for your stored context
-    subject = p.get("Subject") or p.get("subject") or ""
-    from_ = p.get("from") or p.get("From") or ""
-    to_ = p.get("to") or p.get("To") or ""
+    # Optional: prepend a tiny header for your stored context.
+    # If you don't want metadata, return just `body`
+    if subject or from_ or to_:
+        return f"Subject: {subject}\nFrom: {from_}\nTo: {to_}\n\n{body}"
+    return body
 
-    # Prefer plain text; fall back to HTML if needed
-    body = body_plain if str(body_plain).strip() else body_html
 
-    # If you don't want metadata, return just `body`
-    parts = []
-    if subject:
-        parts.append(f"Subject: {subject}".rstrip())
-        parts.append("")  # blank line before body
+async def _extract_in_pool(app: FastAPI, path: Path) -> str:
+    pool = app.state.pool
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            pool, extract_text_from_file, path
+        )
+    except BrokenProcessPool:
+        # A worker died (OOM kill, crash in a parser). The executor refuses
+        # every later submit, so swap in a fresh one for the next requests;
+        # this attachment is reported as failed by the caller.
+        if app.state.pool is pool:
+            logger.error("Extraction pool is broken; starting a new one")
+            app.state.pool = _new_pool()
+            pool.shutdown(wait=False, cancel_futures=True)
+        raise
+
+
+async def _extract_attachments(request: Request, attachments: list) -> List[str]:
+    """Download the usable attachments and return the text extracted from them.
+
+    Files live in a per-request scratch directory under ATTACH_DIR, which is
+    removed again once extraction is done.
+    """
+    valid = []
+    for a in attachments:
+        if not isinstance(a, dict):
+            continue
+        url = a.get("url")
+        if not url or not isinstance(url, str):
+            continue
+        name = a.get("filename")
+        filename = sanitize_filename(name if isinstance(name, str) else None)
+        # no extractor for this type: don't bother downloading it
+        if Path(filename).suffix.lower() not in _EXTRACTORS:
+            continue
+        valid.append((filename, url))
+    if not valid:
+        return []
+
+    await asyncio.to_thread(ATTACH_DIR.mkdir, parents=True, exist_ok=True)
+    work_dir = Path(await asyncio.to_thread(tempfile.mkdtemp, dir=ATTACH_DIR))
+    try:
+        # index prefix keeps same-named attachments apart
+        targets = [(work_dir / f"{i}-{filename}", url) for i, (filename, url) in enumerate(valid)]
+
+        # download all attachments concurrently over the shared client
+        client = request.app.state.http
+        results = await asyncio.gather(
+            *[download_attachment(url, client, p) for p, url in targets], return_exceptions=True
+        )
+        paths = []
+        for (file_path, url), ok in zip(targets, results):
+            if isinstance(ok, Exception):
+                logger.warning("Failed to download %s: %s", url, ok)
+                continue
+            if not ok:
+                logger.warning("Skipped %s: larger than %d bytes", url, MAX_ATTACH)
+                continue
+            paths.append(file_path)
+
+        # extract text inside docx/pdf/txt in parallel across the process pool
+        texts = await asyncio.gather(
+            *[_extract_in_pool(request.app, p) for p in paths],
+            return_exceptions=True,
+        )
+    finally:
+        await asyncio.to_thread(shutil.rmtree, work_dir, ignore_errors=True)
 
-    parts.append(str(body))
-    return "\n".join(parts)
+    extracted_texts = []
+    for file_path, t in zip(paths, texts):
+        if isinstance(t, Exception):
+            logger.warning("Failed to extract text from %s: %s", file_path.name, t)
+        elif t.strip():
+            extracted_texts.append(t)
+    return extracted_texts
 
 
 @app.post("/webhook")
@@ -152,103 +421,194 @@ async def webhook(request: Request):
       - ProxiedMail: {"id": "...", "payload": {..., "body-plain": "...", ...}}
     """
     try:
-        data = await request.json()
-    except Exception:
+        wh = msgspec.json.decode(await request.body(), type=Webhook)
+    except msgspec.ValidationError as e:
+        # well-formed JSON of the wrong shape, e.g. a top-level array or a
+        # non-string "context"
+        raise HTTPException(status_code=400, detail=f"Unsupported webhook payload: {e}")
+    except msgspec.DecodeError:
         raise HTTPException(status_code=400, detail="Invalid JSON")
 
-    # ---- DEBUG: PRINT STRUCTURE ----
-    print("=== RAW WEBHOOK PAYLOAD ===")
-    print(pformat(data, width=120))
-    print("=== END PAYLOAD ===")
+    attachments = wh.attachments if isinstance(wh.attachments, list) else []
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "webhook id=%s legacy=%s attachments=%d",
+            wh.id, wh.context is not None, len(attachments),
+        )
 
     # 1) Legacy path
-    if isinstance(data, dict) and "context" in data:
-        legacy = LegacyWebhook.model_validate(data)
-        cleaned = clean_text(legacy.context)
+    ctx = wh.context
+    if ctx is not None:
+        cleaned = clean_text_bytes(ctx.encode("utf-8"))
 
     # 2) ProxiedMail path
-    elif isinstance(data, dict) and "payload" in data and isinstance(data["payload"], dict):
-        pm = ProxiedMailWebhook.model_validate(data)
-        context = extract_context_from_proxiedmail(pm)
-        cleaned = clean_text(context)
-
-        attachments = data.get("attachments", []) if isinstance(data, dict) else []
-        if not isinstance(attachments, list):
-            attachments = []
-        ATTACH_DIR.mkdir(parents=True, exist_ok=True)
-        
-        extracted_texts = []
-        for a in attachments:
-            if not isinstance(a, dict):
-                continue
-            filename = sanitize_filename(a.get("filename"))
-            url = a.get("url")
-            if not url:
-                continue
+    elif wh.payload is not None:
+        context = extract_context_from_payload(wh.payload)
+        cleaned = clean_text_bytes(context.encode("utf-8"))
 
-            content = await download_attachment(url)
-
-            file_path = ATTACH_DIR / filename
-            file_path.write_bytes(content)
-
-            # extract text inside docx/pdf/txt
-            try:
-                t = extract_text_from_file(file_path)
-                if t.strip():
-                    extracted_texts.append(t)
-            except Exception as e:
-                print(f"Failed to extract text from {filename}: {e}")
-        
-        cleaned += "\n" + "\n".join(extracted_texts)
+        extracted_texts = await _extract_attachments(request, attachments)
+        cleaned += b"\n" + "\n".join(extracted_texts).encode("utf-8")
     else:
         raise HTTPException(
             status_code=400,
             detail="Unsupported webhook payload. Expected either {context: ...} or {payload: {...}}",
         )
 
-    # Ensure base dir exists
-    BASE_DIR.mkdir(parents=True, exist_ok=True)
-
-    try:
-        path = _safe_resolve(BASE_DIR, filename="context.txt")
-    except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid filename")
+    path = CONTEXT_PATH
 
     try:
-        path.write_text(cleaned, encoding="utf-8")
+        key = await asyncio.to_thread(_atomic_write_bytes, path, cleaned)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to write file: {e}")
 
+    global _CTX_CACHE
+    _CTX_CACHE = (key, cleaned)
+
     return {"success": True}
 
 
+def _read_with_stat(path: Path) -> Tuple[str, os.stat_result]:
+    """Read path and stat the same open file, so the two always agree."""
+    with open(path, "rb") as f:
+        st = os.fstat(f.fileno())
+        return f.read().decode("utf-8"), st
+
+
+async def _latest(path: Path, st: os.stat_result) -> Tuple[str, os.stat_result]:
+    """Return the contents of path and the stat describing them.
+
+    Served from _CTX_CACHE while its file key matches st; otherwise the file
+    is re-read (and may turn out to be newer than st).
+    """
+    global _CTX_CACHE
+    key = _file_key(st)
+    if _CTX_CACHE is not None and _CTX_CACHE[0] == key:
+        text = _CTX_CACHE[1]
+        if isinstance(text, str):
+            return text, st
+        text = text.decode("utf-8")
+    else:
+        text, st = await asyncio.to_thread(_read_with_stat, path)
+        key = _file_key(st)
+    _CTX_CACHE = (key, text)
+    return text, st
+
+
+def _accept_q(accept: str, media_type: str) -> float:
+    """q-value the Accept header assigns to media_type (most specific range wins)."""
+    main = media_type.split("/", 1)[0]
+    best, q = -1, 0.0
+    for item in accept.split(","):
+        rng, *params = [part.strip() for part in item.split(";")]
+        rng = rng.lower()
+        if rng == media_type:
+            specificity = 2
+        elif rng == main + "/*":
+            specificity = 1
+        elif rng == "*/*":
+            specificity = 0
+        else:
+            continue
+        if specificity > best:
+            best, q = specificity, 1.0
+            for p in params:
+                name, _, value = p.partition("=")
+                if name.strip().lower() == "q":
+                    try:
+                        q = float(value)
+                    except ValueError:
+                        q = 0.0
+    return q
+
+
+def _prefers_plain(accept: str) -> bool:
+    """True only if the client ranks text/plain strictly above JSON."""
+    accept = accept.lower()
+    if "text/plain" not in accept:
+        return False
+    return _accept_q(accept, "text/plain") > _accept_q(accept, "application/json")
+
+
+def _context_headers(st: os.stat_result, plain: bool) -> Dict[str, str]:
+    """Caching headers for a /latest-context response describing st."""
+    # Weak validator from the file key; the plain and JSON bodies differ, so
+    # they get distinct tags.
+    kind = "-plain" if plain else ""
+    etag = f'W/"{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}{kind}"'
+    return {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+
+
+async def _stream_file(f) -> AsyncIterator[bytes]:
+    """Yield the rest of an open aiofiles file in chunks, then close it."""
+    try:
+        while chunk := await f.read(65536):
+            yield chunk
+    finally:
+        await f.close()
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against etag."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(t.strip().removeprefix("W/") == opaque for t in if_none_match.split(","))
+
+
 @app.get("/latest-context")
-async def get_latest_context():
+async def get_latest_context(request: Request):
     """Return the contents of a text file (from the `files` directory) as JSON.
 
     Response format:
     {
       "context": "... file contents ..."
     }
+
+    Clients that prefer `text/plain` over `application/json` in their Accept
+    header get the raw file contents instead.
     """
-    try:
-        path = _safe_resolve(BASE_DIR, filename="context.txt")
-    except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid filename")
+    path = CONTEXT_PATH
 
     # If the file doesn't exist yet, return empty context (not an error).
-    if not path.exists() or not path.is_file():
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return {"context": ""}
+    if not stat.S_ISREG(st.st_mode):
         return {"context": ""}
 
+    plain = _prefers_plain(request.headers.get("accept", ""))
+    headers = _context_headers(st, plain)
+
+    if _etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    if plain:
+        # Stat the open file rather than reusing st: /webhook may have swapped
+        # in a new file since, and headers must describe the bytes we send.
+        try:
+            f = await aiofiles.open(path, "rb")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to read file: {e}")
+        fst = os.fstat(f.fileno())
+        headers = _context_headers(fst, plain)
+        headers["Content-Length"] = str(fst.st_size)
+        return StreamingResponse(_stream_file(f), media_type="text/plain", headers=headers)
+
     try:
-        text = path.read_text(encoding="utf-8")
+        text, st = await _latest(path, st)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to read file: {e}")
 
-    return {"context": text}
+    return ORJSONResponse({"context": text}, headers=_context_headers(st, plain))
 
 
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run("app.main:app", host="127.0.0.1", port=8000, reload=True)
+    # uvicorn[standard] provides uvloop and httptools; pin them so a plain
+    # uvicorn install fails loudly instead of falling back to asyncio/h11.
+    uvicorn.run("app.main:app", host="127.0.0.1", port=8000, loop="uvloop", http="httptools")
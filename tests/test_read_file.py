@@ -1,3 +1,4 @@
+import pytest
 from fastapi.testclient import TestClient
 from app.main import app
 
@@ -5,6 +6,13 @@ from app.main import app
 client = TestClient(app)
 
 
+@pytest.fixture(scope="module", autouse=True)
+def _lifespan():
+    # run the app's startup/shutdown so the resources it keeps on app.state exist
+    with client:
+        yield
+
+
 def test_read_existing_file():
     resp = client.get("/files/example.txt")
     assert resp.status_code == 200
@@ -24,13 +32,14 @@ def test_path_traversal_blocked():
     assert resp.status_code in (400, 404)
 
 
-def test_webhook_updates_context(tmp_path):
+def test_webhook_updates_context(tmp_path, monkeypatch):
     # write a temporary files/context.txt by pointing BASE_DIR to tmp_path/files
     from app import main as app_main
 
     # Patch base dir for test
-    app_main.BASE_DIR = tmp_path / "files"
+    monkeypatch.setattr(app_main, "BASE_DIR", tmp_path / "files")
     (app_main.BASE_DIR).mkdir(parents=True)
+    monkeypatch.setattr(app_main, "CONTEXT_PATH", app_main.BASE_DIR / "context.txt")
 
     payload = {"context": "Line1\r\n\r\nLine2\n\n\nLine3\twith tab"}
     resp = client.post("/webhook", json=payload)
@@ -53,3 +62,229 @@ def test_webhook_blocks_bad_filename():
         assert False, "Expected ValueError for traversal"
     except ValueError:
         pass
+
+
+def test_clean_text_normalizes_whitespace_and_controls():
+    from app.main import clean_text
+
+    raw = "Line1  \r\n\r\n\r\n\x00Line2\x07\t \n\n\n\nLine3\twith tab\x7f\n"
+    assert clean_text(raw) == "Line1\n\nLine2\n\nLine3\twith tab\n"
+    assert clean_text("  no trailing newline  ") == "no trailing newline"
+
+
+def test_clean_text_bytes_keeps_multibyte_utf8():
+    from app.main import clean_text_bytes
+
+    raw = "caf\u00e9 \u2603\x1b\r\n\n\n\nend".encode("utf-8")
+    assert clean_text_bytes(raw) == "caf\u00e9 \u2603\n\nend".encode("utf-8")
+
+
+def test_latest_context_not_modified(tmp_path, monkeypatch):
+    from app import main as app_main
+
+    monkeypatch.setattr(app_main, "CONTEXT_PATH", tmp_path / "context.txt")
+    resp = client.post("/webhook", json={"context": "hello"})
+    assert resp.status_code == 200
+
+    resp = client.get("/latest-context")
+    assert resp.status_code == 200
+    assert resp.json() == {"context": "hello"}
+    etag = resp.headers["etag"]
+
+    resp = client.get("/latest-context", headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert resp.content == b""
+
+
+def test_extract_context_from_payload():
+    from app.main import ProxiedMailPayload, extract_context_from_payload
+
+    p = ProxiedMailPayload(subject="Hi", from_="a@example.com", body_plain=" ", body_html="<p>x</p>")
+    assert extract_context_from_payload(p) == "Subject: Hi\nFrom: a@example.com\nTo: \n\n<p>x</p>"
+    assert extract_context_from_payload(ProxiedMailPayload(body_plain="just body")) == "just body"
+
+    # loosely typed values: string lists are joined, other objects dropped
+    p = ProxiedMailPayload(to=["a@b", "c@d"], from_={"name": "x"}, body_plain="b")
+    assert extract_context_from_payload(p) == "Subject: \nFrom: \nTo: a@b, c@d\n\nb"
+
+
+def test_webhook_rejects_bad_payloads():
+    assert client.post("/webhook", content=b"{not json").status_code == 400
+    assert client.post("/webhook", json=["context"]).status_code == 400
+    assert client.post("/webhook", json={"context": 123}).status_code == 400
+    assert client.post("/webhook", json={"unrelated": "x"}).status_code == 400
+
+
+def test_latest_context_content_negotiation(tmp_path, monkeypatch):
+    from app import main as app_main
+
+    monkeypatch.setattr(app_main, "CONTEXT_PATH", tmp_path / "context.txt")
+    client.post("/webhook", json={"context": "hello"})
+
+    # axios' default Accept header lists JSON first; it must keep getting JSON
+    resp = client.get("/latest-context", headers={"Accept": "application/json, text/plain, */*"})
+    assert resp.json() == {"context": "hello"}
+    assert "Accept" in resp.headers["vary"]
+
+    resp = client.get("/latest-context", headers={"Accept": "text/plain"})
+    assert resp.headers["content-type"].startswith("text/plain")
+    assert resp.text == "hello"
+    assert "Accept" in resp.headers["vary"]
+
+    # media types are case-insensitive
+    resp = client.get("/latest-context", headers={"Accept": "TEXT/PLAIN"})
+    assert resp.text == "hello"
+
+
+def test_webhook_tolerates_odd_proxiedmail_fields(tmp_path, monkeypatch):
+    from app import main as app_main
+
+    monkeypatch.setattr(app_main, "CONTEXT_PATH", tmp_path / "context.txt")
+    for extra in (
+        {"attachments": None},
+        {"attachments": {"filename": "a.txt"}},
+        {"attachments": ["not-an-object", {"url": 5}]},
+    ):
+        payload = {"payload": {"body-plain": "mail body", "to": ["a@b"]}, **extra}
+        resp = client.post("/webhook", json=payload)
+        assert resp.status_code == 200
+        assert "mail body" in app_main.CONTEXT_PATH.read_text(encoding="utf-8")
+
+
+def test_webhook_attachment_pipeline(tmp_path, monkeypatch):
+    import httpx
+    from app import main as app_main
+
+    monkeypatch.setattr(app_main, "CONTEXT_PATH", tmp_path / "context.txt")
+    monkeypatch.setattr(app_main, "ATTACH_DIR", tmp_path / "attachments")
+    monkeypatch.setattr(app_main, "MAX_ATTACH", 16)
+
+    async def no_length_body():
+        yield b"x" * 10
+        yield b"y" * 10
+
+    requested = []
+
+    def handler(request):
+        requested.append(request.url.path)
+        if request.url.path == "/big":
+            return httpx.Response(200, content=b"z" * 32)
+        if request.url.path == "/streamed-big":
+            return httpx.Response(200, content=no_length_body())
+        if request.url.path == "/missing":
+            return httpx.Response(404)
+        return httpx.Response(200, content=request.url.path.encode())
+
+    monkeypatch.setattr(
+        app_main.app.state, "http", httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    )
+    attachments = [
+        {"filename": "big.txt", "url": "http://mail/big"},
+        {"filename": "big2.txt", "url": "http://mail/streamed-big"},
+        {"filename": "gone.txt", "url": "http://mail/missing"},
+        {"filename": "photo.png", "url": "http://mail/photo"},
+        {"filename": "note.txt", "url": "http://mail/one"},
+        {"filename": "note.txt", "url": "http://mail/two"},
+    ]
+    resp = client.post("/webhook", json={"payload": {"body-plain": "body"}, "attachments": attachments})
+    assert resp.status_code == 200
+
+    written = app_main.CONTEXT_PATH.read_text(encoding="utf-8")
+    assert written.split("\n") == ["body", "/one", "/two"]
+    # unknown suffixes are never fetched
+    assert "/photo" not in requested
+    # downloaded files are removed once their text has been extracted
+    assert list((tmp_path / "attachments").iterdir()) == []
+
+
+def _docx_bytes(text):
+    import io
+
+    import docx
+
+    buf = io.BytesIO()
+    document = docx.Document()
+    document.add_paragraph(text)
+    document.save(buf)
+    return buf.getvalue()
+
+
+def test_webhook_docx_attachment_survives_broken_pool(tmp_path, monkeypatch):
+    import os
+    import signal
+
+    import httpx
+    from app import main as app_main
+
+    monkeypatch.setattr(app_main, "CONTEXT_PATH", tmp_path / "context.txt")
+    monkeypatch.setattr(app_main, "ATTACH_DIR", tmp_path / "attachments")
+    content = _docx_bytes("quarterly numbers")
+    monkeypatch.setattr(
+        app_main.app.state,
+        "http",
+        httpx.AsyncClient(transport=httpx.MockTransport(lambda r: httpx.Response(200, content=content))),
+    )
+    body = {"payload": {"body-plain": "body"}, "attachments": [{"filename": "report.docx", "url": "http://mail/r"}]}
+
+    resp = client.post("/webhook", json=body)
+    assert resp.status_code == 200
+    assert app_main.CONTEXT_PATH.read_text(encoding="utf-8") == "body\nquarterly numbers"
+
+    # a dead worker breaks the pool; the body is still stored
+    pool = app_main.app.state.pool
+    for proc in list(pool._processes.values()):
+        os.kill(proc.pid, signal.SIGKILL)
+        proc.join()
+    resp = client.post("/webhook", json=body)
+    assert resp.status_code == 200
+    assert app_main.CONTEXT_PATH.read_text(encoding="utf-8").startswith("body")
+
+    # and the next request extracts on a fresh pool
+    assert app_main.app.state.pool is not pool
+    resp = client.post("/webhook", json=body)
+    assert resp.status_code == 200
+    assert app_main.CONTEXT_PATH.read_text(encoding="utf-8") == "body\nquarterly numbers"
+
+
+def test_webhook_recreates_missing_base_dir(tmp_path, monkeypatch):
+    from app import main as app_main
+
+    # CONTEXT_PATH is resolved at import; its directory may vanish later
+    monkeypatch.setattr(app_main, "CONTEXT_PATH", tmp_path / "gone" / "context.txt")
+    resp = client.post("/webhook", json={"context": "still here"})
+    assert resp.status_code == 200
+    assert app_main.CONTEXT_PATH.read_text(encoding="utf-8") == "still here"
+
+
+def test_latest_context_cache_keyed_on_inode(tmp_path, monkeypatch):
+    from app import main as app_main
+
+    monkeypatch.setattr(app_main, "CONTEXT_PATH", tmp_path / "context.txt")
+    client.post("/webhook", json={"context": "fresh"})
+
+    # a racing writer left an entry with the same mtime/size but another inode
+    st = app_main.CONTEXT_PATH.stat()
+    stale = ((st.st_ino + 1, st.st_mtime_ns, st.st_size), "stale")
+    monkeypatch.setattr(app_main, "_CTX_CACHE", stale)
+
+    assert client.get("/latest-context").json() == {"context": "fresh"}
+
+
+def test_clean_text_treats_unicode_whitespace_as_blank():
+    from app.main import clean_text
+
+    # NBSP-only lines are common in plain-text email bodies
+    assert clean_text("Hello\n\xa0\n\xa0\n\xa0\nWorld") == "Hello\n\nWorld"
+    assert clean_text(" \xa0 Hi \xa0\x85\nthere ") == "Hi\nthere"
+
+
+def test_clean_text_bytes_is_linear_on_long_whitespace_runs():
+    import time
+    from app.main import clean_text_bytes
+
+    # long runs that don't end a line used to make the trailing-whitespace
+    # regex rescan the run from every position
+    raw = (b" " * 1000 + b"x") * 500
+    start = time.perf_counter()
+    assert clean_text_bytes(raw) == raw.strip()
+    assert time.perf_counter() - start < 1.0